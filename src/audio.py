@@ -9,34 +9,48 @@ load_dotenv()
 
 from lmnt.api import Speech
 
+from src.hedging import hedged_call, provider_deadline
+
 
 LMNT_API_KEY = os.environ.get('LMNT_API_KEY')
 
 
-async def generate_audio_file(text_to_synthetize, output_filepth='output.wav'):
+async def synthesize(text_to_synthetize):
     async with Speech(LMNT_API_KEY) as speech:
-        synthesis = await speech.synthesize(
+        return await speech.synthesize(
             text_to_synthetize, 
             voice='lily', 
             format='wav', 
             return_durations=True
         )
-        with open(output_filepth, 'wb') as f:
-            f.write(synthesis['audio'])
 
-        duration = get_audio_duration(output_filepth)
-            
-        return duration, synthesis['durations']
+def save_synthesis(synthesis, output_filepth='output.wav'):
+    """
+    Writes the synthesized audio to disk.
+    Returns the duration of the audio in seconds and the word durations.
+    """
+    with open(output_filepth, 'wb') as f:
+        f.write(synthesis['audio'])
+
+    duration = get_audio_duration(output_filepth)
+
+    return duration, synthesis['durations']
+
+async def generate_audio_file(text_to_synthetize, output_filepth='output.wav'):
+    synthesis = await synthesize(text_to_synthetize)
+    return save_synthesis(synthesis, output_filepth)
 
 def generate_audio_file_sync(text_to_synthesize, output_filepath='output.wav'):
     """
-    Wrapper to call the asynchronous `generate_audio_file` function synchronously.
-    Returns the duration of the generated audio in seconds.
+    Calls LMNT synchronously under its deadline, hedging slow requests (see src.hedging).
+    Returns the duration of the generated audio in seconds and the word durations.
     """
-    async def wrapper():
-        return await generate_audio_file(text_to_synthesize, output_filepath)
-    
-    return asyncio.run(wrapper())
+    # The timeout cancels a hung request so it does not hold a hedging worker forever
+    synthesis = hedged_call(
+        "lmnt",
+        lambda: asyncio.run(asyncio.wait_for(synthesize(text_to_synthesize), timeout=provider_deadline("lmnt")))
+    )
+    return save_synthesis(synthesis, output_filepath)
 
 def generate_audio_and_update_state(text, state, output_filepath='output.wav'):
     """
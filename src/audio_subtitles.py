@@ -8,11 +8,9 @@ FONT = f"{PROJECT_ROOT}/quattrocentosans-regular-webfont.ttf"
 
 def join_video_with_audio(video_file_path, audio_file_path, output_file_path):
 
-    video = VideoFileClip(video_file_path)
-    audio = AudioFileClip(audio_file_path)
-
-    video_with_audio = video.with_audio(audio)
-    video_with_audio.write_videofile(output_file_path, codec="libx264", audio_codec="aac")
+    with VideoFileClip(video_file_path) as video, AudioFileClip(audio_file_path) as audio:
+        video_with_audio = video.with_audio(audio)
+        video_with_audio.write_videofile(output_file_path, codec="libx264", audio_codec="aac")
 
 
 def add_subtitle_to_video(video_file_path, subtitle_file_path, output_file_path):
@@ -34,7 +32,12 @@ def add_subtitle_to_video(video_file_path, subtitle_file_path, output_file_path)
     ]
 
     video_with_subtitles = CompositeVideoClip([video, *video_subtiles])
-    video_with_subtitles.write_videofile(output_file_path, codec="libx264", audio_codec="aac")
+    try:
+        video_with_subtitles.write_videofile(output_file_path, codec="libx264", audio_codec="aac")
+    finally:
+        # Release the decoder and the rendered word images right away
+        for clip in [video_with_subtitles, video, *video_subtiles]:
+            clip.close()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,256 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+import ffmpeg
+from loguru import logger
+
+from src import OUTPUT_DIR, VIDEOS_DIR
+from src.audio_subtitles import FONT
+from src.render_formats import output_path_for_format
+from src.storage import load_catalogue, touch_run
+
+COMPILATIONS_DIR = os.path.join(VIDEOS_DIR, "compilations")
+
+# Title card shown before every fact, the only part of a compilation that is encoded
+INSERT_DURATION_SEC = 2
+INSERT_LINE_WIDTH = 24
+
+# Stream parameters that must match for the videos to be concatenated without re-encoding
+# The concat demuxer reuses the decoder configuration of its first input (the first
+# title card), so level, reference frames and B-frame reordering must match as well
+MATCHED_VIDEO_KEYS = [
+    "codec_name", "profile", "level", "has_b_frames", "refs",
+    "width", "height", "pix_fmt", "r_frame_rate", "time_base",
+]
+MATCHED_AUDIO_KEYS = ["codec_name", "profile", "sample_rate", "channels"]
+
+
+def select_runs(topic=None, limit=10, format_name="9:16"):
+    """
+    Picks runs from the storage catalogue, oldest first.
+
+    Args:
+        topic (str): Only keep runs whose topic contains this text (case insensitive)
+        limit (int): Maximum number of runs
+        format_name (str): Output format the runs must have been rendered in
+
+    Returns:
+        list: Run ids
+    """
+    final_video_name = os.path.basename(output_path_for_format("", format_name))
+    catalogue = load_catalogue()
+
+    run_ids = []
+    for run_id in sorted(catalogue, key=lambda run: catalogue[run]["created"]):
+        entry = catalogue[run_id]
+        if final_video_name not in entry["files"] or "result.json" not in entry["files"]:
+            continue
+        if topic is not None and topic.lower() not in (entry.get("topic") or "").lower():
+            continue
+        run_ids.append(run_id)
+
+    return run_ids[:limit]
+
+
+def probe_encoding(video_file_path):
+    """
+    Returns the encoding parameters and duration of a video.
+
+    Returns:
+        dict: {"video": {...}, "audio": {...}, "duration": float}
+    """
+    probe = ffmpeg.probe(video_file_path)
+    streams = {stream["codec_type"]: stream for stream in probe["streams"]}
+    return {
+        "video": {key: streams["video"].get(key) for key in MATCHED_VIDEO_KEYS},
+        "audio": {key: streams["audio"].get(key) for key in MATCHED_AUDIO_KEYS},
+        "duration": float(probe["format"]["duration"]),
+    }
+
+
+def _matches(encoding, reference):
+    return encoding["video"] == reference["video"] and encoding["audio"] == reference["audio"]
+
+
+def _x264_params(video_params):
+    # ffprobe's has_b_frames is the reordering delay: 0 without B-frames, 1 with
+    # B-frames but no pyramid, 2 with x264's default pyramid
+    params = [f"ref={video_params['refs']}"]
+    if video_params["has_b_frames"] == 0:
+        params.append("bframes=0")
+    elif video_params["has_b_frames"] == 1:
+        params.append("b-pyramid=none")
+    return ":".join(params)
+
+
+def make_insert(text, reference, output_path, duration=INSERT_DURATION_SEC):
+    """
+    Encodes a short title card with the same parameters as the reference encoding,
+    so it can be concatenated with stream copy.
+
+    Raises:
+        Exception: The title card could not be encoded with the reference parameters
+    """
+    video_params = reference["video"]
+    audio_params = reference["audio"]
+
+    video = ffmpeg.input(
+        f"color=c=black:s={video_params['width']}x{video_params['height']}:r={video_params['r_frame_rate']}",
+        f="lavfi", t=duration,
+    )
+    audio = ffmpeg.input(
+        f"anullsrc=r={audio_params['sample_rate']}:cl={'mono' if audio_params['channels'] == 1 else 'stereo'}",
+        f="lavfi", t=duration,
+    )
+    video = video.filter(
+        "drawtext",
+        fontfile=FONT,
+        text="\n".join(textwrap.wrap(text, INSERT_LINE_WIDTH)),
+        expansion="none",
+        fontcolor="white",
+        fontsize=video_params["width"] // 14,
+        x="(w-text_w)/2",
+        y="(h-text_h)/2",
+    )
+
+    profile = (video_params["profile"] or "high").lower().replace("constrained ", "")
+    (
+        ffmpeg.output(
+            video, audio, output_path,
+            vcodec="libx264", pix_fmt=video_params["pix_fmt"],
+            acodec="aac", ar=audio_params["sample_rate"], ac=audio_params["channels"],
+            video_track_timescale=video_params["time_base"].split("/")[1],
+            **{
+                "profile:v": profile,
+                "level:v": f"{video_params['level'] / 10:.1f}",
+                "x264-params": _x264_params(video_params),
+            },
+        )
+        .global_args("-hide_banner", "-loglevel", "error")
+        .overwrite_output()
+        .run()
+    )
+
+    encoding = probe_encoding(output_path)
+    if not _matches(encoding, reference):
+        raise Exception(f"Title card encoded as {encoding['video']}, expected {video_params}")
+
+
+def _escape_metadata(value):
+    for char in ["\\", "=", ";", "#", "\n"]:
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def write_chapters(chapters, title, metadata_path):
+    """Writes (title, start_sec, end_sec) chapters as an FFMETADATA file"""
+    lines = [";FFMETADATA1", f"title={_escape_metadata(title)}"]
+    for chapter_title, start, end in chapters:
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={int(start * 1000)}",
+            f"END={int(end * 1000)}",
+            f"title={_escape_metadata(chapter_title)}",
+        ]
+    with open(metadata_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def compile_videos(run_ids, output_path, title, format_name="9:16", insert_duration=INSERT_DURATION_SEC):
+    """
+    Concatenates the final videos of several runs into one video with chapters.
+
+    The run videos are stream copied; only the title cards are encoded, with the
+    parameters of the first run. Runs encoded differently are skipped.
+
+    Args:
+        run_ids (list): Runs to compile, in order
+        output_path (str): Path of the compilation
+        title (str): Title of the compilation, shown on the first card. "{count}" is
+                     replaced by the number of runs kept
+        format_name (str): Output format of the run videos to use
+        insert_duration (float): Length of each title card in seconds, 0 for none
+
+    Returns:
+        str: Path of the compilation
+    """
+    logger.info(f"compile_videos {len(run_ids)} runs...")
+
+    segments = []
+    reference = None
+    for run_id in run_ids:
+        run_dir = os.path.join(OUTPUT_DIR, run_id)
+        video_file_path = output_path_for_format(run_dir, format_name)
+        encoding = probe_encoding(video_file_path)
+        if reference is None:
+            reference = encoding
+        elif not _matches(encoding, reference):
+            logger.warning(f"skipping {run_id}: encoded as {encoding}, expected {reference}")
+            continue
+
+        with open(os.path.join(run_dir, "result.json")) as f:
+            topic = json.load(f)["topic"]
+        segments.append((run_id, topic, video_file_path, encoding["duration"]))
+        touch_run(run_id)
+
+    if not segments:
+        raise Exception("No runs to compile")
+
+    # Runs may have been skipped, count the ones actually compiled
+    title = title.replace("{count}", str(len(segments)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        concat_files = []
+        chapters = []
+        position = 0.0
+
+        for index, (run_id, topic, video_file_path, duration) in enumerate(segments):
+            chapter_start = position
+            if insert_duration > 0:
+                card_text = f"{title} - #{index + 1} {topic}" if index == 0 else f"#{index + 1} {topic}"
+                insert_path = os.path.join(tmp_dir, f"insert_{index}.mp4")
+                make_insert(card_text, reference, insert_path, insert_duration)
+                concat_files.append(insert_path)
+                position += probe_encoding(insert_path)["duration"]
+
+            concat_files.append(video_file_path)
+            position += duration
+            chapters.append((f"#{index + 1} {topic}", chapter_start, position))
+
+        list_path = os.path.join(tmp_dir, "concat.txt")
+        with open(list_path, "w") as f:
+            for path in concat_files:
+                escaped_path = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped_path}'\n")
+
+        metadata_path = os.path.join(tmp_dir, "chapters.txt")
+        write_chapters(chapters, title, metadata_path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        subprocess.run([
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", metadata_path,
+            "-map", "0", "-map_metadata", "1", "-map_chapters", "1",
+            "-c", "copy", "-movflags", "+faststart",
+            output_path,
+        ], check=True)
+
+    return output_path
+
+
+if __name__ == "__main__":
+
+    topic = sys.argv[1] if len(sys.argv) > 1 else None
+    run_ids = select_runs(topic=topic, limit=10)
+
+    title = f"{{count}} weird facts about {topic}" if topic else "{count} weird facts"
+    file_name = f"weird_facts_{topic}" if topic else "weird_facts"
+    output_path = os.path.join(COMPILATIONS_DIR, f"{file_name.replace(' ', '_')}.mp4")
+
+    print(compile_videos(run_ids, output_path, title))
@@ -2,6 +2,9 @@ from typing import Annotated, Dict, TypedDict
 import uuid
 import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from langgraph.graph import Graph
 from langchain_core.messages import BaseMessage
 from langchain_core.prompts import PromptTemplate
@@ -11,15 +14,29 @@ from langchain.output_parsers import PydanticOutputParser
 
 # Import our existing components
 from src.topic_handler import create_topic_chain, TopicOutput
-from src.langchain_facts import create_fact_chain
+from src.langchain_facts import create_search_tool, create_fact_generation_chain
 from src.audio import generate_audio_and_update_state
 from src.get_images import create_image_generation_chain
+from src.hedging import get_hedge_metrics
+from src.storage import register_run
+from src.profiling import profiled_node, start_run_profile, finish_run_profile
+from src.model_router import model_router
+from src.speculation import (
+    normalize_query, query_similarity, record_speculation, get_speculation_stats,
+    SPECULATIVE_SEARCH, SIMILARITY_THRESHOLD,
+)
 from loguru import logger
 
 from src import OUTPUT_DIR
 
+# Images are generated once in the tallest geometry; the render stage crops/pads
+# them into every output format (see src.render_formats.OUTPUT_FORMATS)
+IMAGE_ASPECT_RATIO = "9:16"
+
 class WorkflowState(TypedDict):
     thread_id: str
+    latency_budget: float | None
+    quality: str
     topic: str
     facts: str
     is_random: bool
@@ -44,27 +61,56 @@ class ImagePrompts(BaseModel):
         }
     }
 
-def create_fact_workflow() -> Graph:
-    # Initialize our chains
-    topic_chain = create_topic_chain()
-    facts_chain = create_fact_chain()
+def create_fact_workflow(speculative_search: bool = SPECULATIVE_SEARCH) -> Graph:
+    # Initialize our chains, the LLM ones are built per model picked by the router
+    get_topic_chain = lru_cache(maxsize=None)(create_topic_chain)
+    search = create_search_tool()
+    get_fact_generation_chain = lru_cache(maxsize=None)(create_fact_generation_chain)
     image_chain = create_image_generation_chain()
+
+    # Searches started on the raw user input while the topic is extracted, by thread_id
+    speculation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative_search")
+    speculative_searches = {}
+
+    def timed_search(query):
+        start = time.monotonic()
+        search_results = search.invoke(query)
+        return search_results, time.monotonic() - start
     
     # Create LLM chain for prompt generation
-    llm = ChatMistralAI(
-        model="mistral-medium",  # or "mistral-small", "mistral-large" depending on your needs
-        temperature=0.7,
-        response_format = {
-            "type": "json_object",
-        }
-    )
+    @lru_cache(maxsize=None)
+    def get_prompt_llm(model, max_tokens):
+        return ChatMistralAI(
+            model=model,  # "mistral-medium" unless the router degrades it
+            temperature=0.7,
+            max_tokens=max_tokens,
+            response_format = {
+                "type": "json_object",
+            }
+        )
+
+    def route(state, stage):
+        """Pick the model of an LLM stage from the request's latency budget and quality tier"""
+        model, max_tokens = model_router.choose(
+            stage,
+            latency_budget=state.get("latency_budget"),
+            quality=state.get("quality", "high"),
+        )
+        state.setdefault("models", {})[stage] = model
+        return model, max_tokens
     
     def process_topic(state: Dict) -> WorkflowState:
         """Process the user input to determine the topic"""
 
         logger.info('process_topic...')
 
-        topic_result = topic_chain.invoke({'user_input': state['user_input']})
+        if speculative_search:
+            query = normalize_query(state['user_input'])
+            speculative_searches[state['thread_id']] = (query, speculation_executor.submit(timed_search, query))
+
+        model, max_tokens = route(state, "topic")
+        with model_router.track("topic", model):
+            topic_result = get_topic_chain(model, max_tokens).invoke({'user_input': state['user_input']})
         return {
             **state,
             "topic": topic_result.topic,
@@ -76,11 +122,42 @@ def create_fact_workflow() -> Graph:
 
         logger.info('generate_facts...')
 
-        facts_result = facts_chain.invoke(state["topic"])
+        search_results = None
+        speculation_report = None
+
+        # Reuse the speculative search when the topic is (nearly) the user's text
+        speculation = speculative_searches.pop(state["thread_id"], None)
+        if speculation is not None:
+            query, future = speculation
+            similarity = query_similarity(query, normalize_query(state["topic"]))
+            if similarity >= SIMILARITY_THRESHOLD:
+                wait_start = time.monotonic()
+                try:
+                    search_results, search_duration = future.result()
+                    latency_saved = max(search_duration - (time.monotonic() - wait_start), 0.0)
+                    speculation_report = record_speculation(True, similarity, latency_saved)
+                except Exception as e:
+                    logger.warning(f"speculative search failed: {e}")
+                    speculation_report = record_speculation(False, similarity, failed=True)
+            else:
+                # Only drops a search still queued, a running one completes and is discarded
+                future.cancel()
+                speculation_report = record_speculation(False, similarity)
+
+        if search_results is None:
+            search_results = search.invoke(state["topic"])
+
+        model, max_tokens = route(state, "facts")
+        with model_router.track("facts", model):
+            facts_result = get_fact_generation_chain(model, max_tokens).invoke({
+                "topic": state["topic"],
+                "search_results": search_results,
+            })
         return {
             **state,
             "viral_fact": facts_result.viral_fact,
             "description": facts_result.description,
+            "speculative_search": speculation_report,
         }
     
     def generate_audio(state: Dict) -> WorkflowState:
@@ -153,8 +230,10 @@ def create_fact_workflow() -> Graph:
         )
         
         # Generate prompts using the LLM
-        chain = base_prompt | llm | parser
-        prompt_result = chain.invoke({"viral_fact": state["viral_fact"]})
+        model, max_tokens = route(state, "image_prompts")
+        chain = base_prompt | get_prompt_llm(model, max_tokens) | parser
+        with model_router.track("image_prompts", model):
+            prompt_result = chain.invoke({"viral_fact": state["viral_fact"]})
         
         return {
             **state,
@@ -175,7 +254,7 @@ def create_fact_workflow() -> Graph:
             
             image_result = image_chain.invoke({
                 "prompt": prompt,
-                "aspect_ratio": "9:16",
+                "aspect_ratio": IMAGE_ASPECT_RATIO,
                 "output_filepath": output_filepath
             })
             
@@ -206,23 +285,34 @@ def create_fact_workflow() -> Graph:
             "txt2img_prompts": state["txt2img_prompts"],
             "image_filepaths": state["image_filepaths"],
             "image_instructions": state["image_instructions"],
+            "speculative_search": state.get("speculative_search"),
+            "models": state.get("models"),
         }
         with open(f"{thread_dir}/result.json", "w") as f:
             json.dump(state_to_save, f, indent=2)
+
+        logger.info(f"hedge metrics: {get_hedge_metrics()}")
+        logger.info(f"speculative search stats: {get_speculation_stats()}")
+
+        # The catalogue is bookkeeping, it must not fail the video generation
+        try:
+            register_run(state["thread_id"])
+        except Exception as e:
+            logger.error(f"could not register run in the storage catalogue: {e}")
             
         return state
     
     # Create the workflow graph
     workflow = Graph()
     
-    # Add nodes
-    workflow.add_node("process_topic", process_topic)
-    workflow.add_node("generate_facts", generate_facts)
-    workflow.add_node("generate_audio", generate_audio)
-    workflow.add_node("generate_image_instructions", generate_image_instructions)
-    workflow.add_node("create_txt2img_prompt", create_txt2img_prompt)
-    workflow.add_node("generate_image", generate_image)
-    workflow.add_node("save_state", save_state)
+    # Add nodes, profiled when the run is (see src.profiling)
+    workflow.add_node("process_topic", profiled_node("process_topic", process_topic))
+    workflow.add_node("generate_facts", profiled_node("generate_facts", generate_facts))
+    workflow.add_node("generate_audio", profiled_node("generate_audio", generate_audio))
+    workflow.add_node("generate_image_instructions", profiled_node("generate_image_instructions", generate_image_instructions))
+    workflow.add_node("create_txt2img_prompt", profiled_node("create_txt2img_prompt", create_txt2img_prompt))
+    workflow.add_node("generate_image", profiled_node("generate_image", generate_image))
+    workflow.add_node("save_state", profiled_node("save_state", save_state))
     
     # Define edges
     workflow.add_edge("process_topic", "generate_facts")
@@ -256,9 +346,13 @@ if __name__ == "__main__":
 
     for user_input in test_inputs:
         print(f"\nInput: {user_input}")
-        result = workflow.invoke({
-            "user_input": user_input,
-            "thread_id": thread_id,
-        })
+        start_run_profile(thread_id)
+        try:
+            result = workflow.invoke({
+                "user_input": user_input,
+                "thread_id": thread_id,
+            })
+        finally:
+            finish_run_profile(thread_id)
         print(f"Thread ID: {result['thread_id']}")
         print(f"Topic: {result['topic']} (Random: {result['is_random']})")
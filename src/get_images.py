@@ -4,6 +4,8 @@ from dotenv import load_dotenv
 import requests
 import os
 
+from src.hedging import hedged_call, provider_deadline
+
 load_dotenv()
 
 class ImageGenerationInput(TypedDict):
@@ -14,26 +16,29 @@ class ImageGenerationInput(TypedDict):
 class ImageGenerationOutput(TypedDict):
     output_filepath: str
 
+SEGMIND_URL = "https://api.segmind.com/v1/fast-flux-schnell"
+
+def request_image(data, headers):
+    response = requests.post(SEGMIND_URL, json=data, headers=headers, timeout=provider_deadline("segmind"))
+    if response.status_code != 200:
+        raise Exception(f"Error {response.status_code}: {response.text}")
+    return response
+
 def generate_image(input: ImageGenerationInput) -> ImageGenerationOutput:
 
     print('generating image...')
     
-    url = "https://api.segmind.com/v1/fast-flux-schnell"
-    
     data = {
         "prompt": input["prompt"],
         "aspect_ratio": input["aspect_ratio"]
     }
 
     headers = {'x-api-key': os.environ.get('SEGMIND_API_KEY')}
-    response = requests.post(url, json=data, headers=headers)
+    response = hedged_call("segmind", request_image, data, headers)
 
-    if response.status_code == 200:
-        with open(input["output_filepath"], 'wb') as f:
-            f.write(response.content)
-        return {"output_filepath": input["output_filepath"]}
-    else:
-        raise Exception(f"Error {response.status_code}: {response.text}")
+    with open(input["output_filepath"], 'wb') as f:
+        f.write(response.content)
+    return {"output_filepath": input["output_filepath"]}
 
 def create_image_generation_chain():
     return RunnableLambda(generate_image)
\ No newline at end of file
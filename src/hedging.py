@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from loguru import logger
+
+# Per-provider settings:
+# - deadline_sec: hard limit for a call, hedges included
+# - hedge: send a duplicate request when the first one is slower than usual
+# - hedge_percentile: percentile of recent latencies after which the duplicate is sent
+# - max_hedge_ratio: cap on hedges / calls so hedging cannot blow through the quotas
+# - min_samples: number of observed latencies needed before hedging kicks in
+PROVIDER_SETTINGS = {
+    "segmind": {"deadline_sec": 60, "hedge": True, "hedge_percentile": 95, "max_hedge_ratio": 0.1, "min_samples": 10},
+    "lmnt": {"deadline_sec": 30, "hedge": True, "hedge_percentile": 95, "max_hedge_ratio": 0.1, "min_samples": 10},
+}
+
+LATENCY_WINDOW = 200
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedged_call")
+_lock = threading.Lock()
+_trackers = {}
+_metrics = {}
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent latencies of a provider (or model) and reports percentiles.
+    With max_age_sec, samples older than that are dropped so stale latencies age out.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW, max_age_sec=None):
+        self._latencies = deque(maxlen=window)
+        self._max_age_sec = max_age_sec
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        if self._max_age_sec is None:
+            return
+        cutoff = time.monotonic() - self._max_age_sec
+        while self._latencies and self._latencies[0][0] < cutoff:
+            self._latencies.popleft()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def percentile(self, q):
+        """Returns the q-th percentile of the recent latencies, or None without samples"""
+        with self._lock:
+            self._prune()
+            if not self._latencies:
+                return None
+            return float(np.percentile([seconds for _, seconds in self._latencies], q))
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._latencies)
+
+
+def get_latency_tracker(provider):
+    with _lock:
+        if provider not in _trackers:
+            _trackers[provider] = LatencyTracker()
+        return _trackers[provider]
+
+
+def provider_deadline(provider):
+    """Returns the per-call deadline in seconds of a provider"""
+    return PROVIDER_SETTINGS[provider]["deadline_sec"]
+
+
+def _count(provider, key):
+    with _lock:
+        metrics = _metrics.setdefault(provider, {"calls": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0})
+        metrics[key] += 1
+
+
+def _hedge_allowed(provider):
+    settings = PROVIDER_SETTINGS[provider]
+    with _lock:
+        metrics = _metrics[provider]
+        return metrics["hedges"] + 1 <= settings["max_hedge_ratio"] * metrics["calls"]
+
+
+def get_hedge_metrics():
+    """
+    Returns the hedging counters of every provider.
+
+    Returns:
+        dict: For each provider, the calls, hedges, hedge wins and timeouts counts
+              along with the hedge rate (hedges / calls) and win rate (hedge wins / hedges)
+    """
+    with _lock:
+        report = {}
+        for provider, metrics in _metrics.items():
+            report[provider] = {
+                **metrics,
+                "hedge_rate": metrics["hedges"] / metrics["calls"] if metrics["calls"] else 0.0,
+                "win_rate": metrics["hedge_wins"] / metrics["hedges"] if metrics["hedges"] else 0.0,
+            }
+        return report
+
+
+def hedged_call(provider, fn, *args, **kwargs):
+    """
+    Calls fn(*args, **kwargs) under the deadline of the provider, hedging slow calls.
+
+    If the call is still pending once the configured percentile of the recent latencies
+    has elapsed, and the hedge budget allows it, a duplicate call is sent and whichever
+    succeeds first is returned. A call that fails is not retried. fn must be safe to run
+    twice (no shared output file).
+
+    Raises:
+        TimeoutError: No call succeeded before the deadline
+        Exception: Every call failed, the first error is raised
+    """
+    settings = PROVIDER_SETTINGS[provider]
+    tracker = get_latency_tracker(provider)
+    _count(provider, "calls")
+
+    def timed_call():
+        start = time.monotonic()
+        result = fn(*args, **kwargs)
+        tracker.observe(time.monotonic() - start)
+        return result
+
+    deadline = time.monotonic() + settings["deadline_sec"]
+    primary = _executor.submit(timed_call)
+    pending = {primary}
+    errors = []
+
+    hedge_delay = None
+    if settings["hedge"] and len(tracker) >= settings["min_samples"]:
+        hedge_delay = tracker.percentile(settings["hedge_percentile"])
+
+    # Only hedge a call that is still pending, a failed primary is not retried
+    if hedge_delay is not None:
+        done, _ = wait({primary}, timeout=min(hedge_delay, settings["deadline_sec"]))
+        if not done and time.monotonic() < deadline and _hedge_allowed(provider):
+            logger.info(f"{provider}: no response after {hedge_delay:.2f}s, sending a hedged request")
+            _count(provider, "hedges")
+            pending.add(_executor.submit(timed_call))
+
+    while pending:
+        done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    _count(provider, "hedge_wins")
+                return future.result()
+            errors.append(future.exception())
+
+    if errors and not pending:
+        raise errors[0]
+
+    _count(provider, "timeouts")
+    raise TimeoutError(f"{provider} call exceeded its {settings['deadline_sec']}s deadline")
@@ -20,20 +20,25 @@ class FactOutput(BaseModel):
         }
     }
 
-def create_fact_chain():
+def create_search_tool():
     """
-    Creates a LangChain pipeline for generating facts.
+    Creates the Tavily search used to ground the facts.
+    """
+    return TavilySearchResults(api_key=os.getenv("TAVILY_API_KEY"))
+
+def create_fact_generation_chain(model="mistral-large-latest", max_tokens=2000):
+    """
+    Creates the LLM part of the fact pipeline, taking the topic and its search results.
     """
     mistral = ChatMistralAI(
-        model="mistral-large-latest",
+        model=model,
         temperature=0.7,
-        max_tokens=2000,
+        max_tokens=max_tokens,
         response_format = {
             "type": "json_object",
         }
     )
     
-    search = TavilySearchResults(api_key=os.getenv("TAVILY_API_KEY"))
     parser = PydanticOutputParser(pydantic_object=FactOutput)
     
     # Create prompts for both viral fact and video description
@@ -56,13 +61,19 @@ def create_fact_chain():
     # Partially fill the prompt template with format instructions
     facts_prompts_with_format = facts_prompts.partial(format_instructions=parser.get_format_instructions())
     
+    return facts_prompts_with_format | mistral | parser
+
+def create_fact_chain():
+    """
+    Creates a LangChain pipeline for generating facts.
+    """
+    search = create_search_tool()
+    
     # Combine search and LLM into a chain
     facts_chain = (
         {"topic": lambda x: x, 
          "search_results": search} 
-        | facts_prompts_with_format 
-        | mistral 
-        | parser
+        | create_fact_generation_chain()
     )
     
     return facts_chain
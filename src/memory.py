@@ -0,0 +1,210 @@
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from loguru import logger
+
+# Default per-job memory budgets of the render stage
+RENDER_MEMORY_BUDGET_BYTES = 1536 * 1024 ** 2
+DRAFT_MEMORY_BUDGET_BYTES = 256 * 1024 ** 2
+
+# Share of the host memory the renders may reserve in total
+HOST_MEMORY_FRACTION = 0.8
+
+RSS_SAMPLE_INTERVAL_SEC = 0.05
+
+# Rough model of a render's footprint, used to pick the source resolution under a budget:
+# decoded RGB images + moviepy composition buffers (float frames) + one x264 encoder per output
+FRAME_BUFFERS = 4
+FRAME_BUFFER_BYTES_PER_PIXEL = 3 * 8
+ENCODER_BYTES_PER_PIXEL = 64
+MIN_SOURCE_HEIGHT = 480
+
+# tracemalloc and RSS are process wide: a profile only reports per-job peaks when no
+# other profile overlapped it, tracked with the number of active profiles and a counter
+# bumped every time one starts
+_profiles_lock = threading.Lock()
+_active_profiles = 0
+_profile_starts = 0
+_tracemalloc_owned = False
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is the peak, in kB on Linux, the best we can do without /proc
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def available_memory():
+    """Returns the memory available on the host in bytes"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+
+
+class MemoryProfile:
+    """
+    Tracks the peak memory of a block with RSS sampling, plus tracemalloc when asked.
+
+    tracemalloc slows down every allocation of the process, so it is only turned on with
+    trace_python, an explicit opt-in separate from CPU profiling. RSS and tracemalloc
+    are process wide: when other profiles overlap this one, the per-job peaks are not
+    reported (overlapped is True and peak_traced stays None). Use as a context manager,
+    the peaks are available after exit.
+    """
+
+    def __init__(self, name, budget_bytes=None, trace_python=False):
+        self.name = name
+        self.budget_bytes = budget_bytes
+        self.trace_python = trace_python
+        self.rss_start = None
+        self.peak_rss = None
+        self.peak_traced = None
+        self.overlapped = False
+        self._start_count = None
+        self._tracing = False
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def _sample_rss(self):
+        while not self._stop_event.wait(RSS_SAMPLE_INTERVAL_SEC):
+            self.peak_rss = max(self.peak_rss, current_rss())
+
+    def __enter__(self):
+        global _active_profiles, _profile_starts, _tracemalloc_owned
+        with _profiles_lock:
+            self.overlapped = _active_profiles > 0
+            _active_profiles += 1
+            _profile_starts += 1
+            self._start_count = _profile_starts
+
+            # Only a profile running alone traces, so the peak it resets is its own
+            if self.trace_python and not self.overlapped:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    _tracemalloc_owned = True
+                tracemalloc.reset_peak()
+                self._tracing = True
+
+        self.rss_start = current_rss()
+        self.peak_rss = self.rss_start
+        self._sampler = threading.Thread(target=self._sample_rss, name=f"rss_{self.name}", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_profiles, _tracemalloc_owned
+        self._stop_event.set()
+        self._sampler.join()
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+        with _profiles_lock:
+            _active_profiles -= 1
+            self.overlapped = self.overlapped or _profile_starts != self._start_count
+            if self._tracing:
+                if not self.overlapped:
+                    self.peak_traced = tracemalloc.get_traced_memory()[1]
+                if _tracemalloc_owned:
+                    tracemalloc.stop()
+                    _tracemalloc_owned = False
+
+        if self.overlapped:
+            logger.info(
+                f"{self.name}: process peak RSS {self.peak_rss / 1024 ** 2:.0f} MB, "
+                "shared with concurrent renders so no per-job peak"
+            )
+            return False
+
+        peak_delta = self.peak_rss - self.rss_start
+        traced = f", peak traced {self.peak_traced / 1024 ** 2:.0f} MB" if self.peak_traced is not None else ""
+        logger.info(
+            f"{self.name}: peak RSS {self.peak_rss / 1024 ** 2:.0f} MB "
+            f"(+{peak_delta / 1024 ** 2:.0f} MB){traced}"
+        )
+        if self.budget_bytes is not None and peak_delta > self.budget_bytes:
+            logger.warning(f"{self.name}: exceeded its memory budget of {self.budget_bytes / 1024 ** 2:.0f} MB")
+        return False
+
+
+def estimate_render_memory(n_images, source_height, source_aspect, output_sizes):
+    """
+    Estimates the memory used by a render in bytes.
+
+    Args:
+        n_images (int): Number of images in the timeline
+        source_height (int): Height the images are decoded at
+        source_aspect (float): Width / height of the images
+        output_sizes (list): (width, height) of every encoder output
+    """
+    source_pixels = int(source_height * source_aspect) * source_height
+    images = n_images * source_pixels * 3
+    frame_buffers = FRAME_BUFFERS * source_pixels * FRAME_BUFFER_BYTES_PER_PIXEL
+    encoders = sum(width * height * ENCODER_BYTES_PER_PIXEL for width, height in output_sizes)
+    return images + frame_buffers + encoders
+
+
+def fit_source_height(budget_bytes, n_images, source_height, source_aspect, output_sizes):
+    """
+    Returns the largest source height, at most source_height, whose render fits the budget.
+
+    Raises:
+        MemoryError: Even MIN_SOURCE_HEIGHT does not fit the budget
+    """
+    height = source_height
+    while estimate_render_memory(n_images, height, source_aspect, output_sizes) > budget_bytes:
+        if height <= MIN_SOURCE_HEIGHT:
+            raise MemoryError(f"render of {n_images} images to {output_sizes} does not fit in {budget_bytes} bytes")
+        height = max(int(height * 0.9), MIN_SOURCE_HEIGHT)
+    return height
+
+
+class MemoryScheduler:
+    """
+    Admits renders while the sum of their memory budgets fits in the host capacity.
+
+    A job larger than the whole capacity is admitted alone rather than never.
+    """
+
+    def __init__(self, capacity_bytes):
+        self.capacity_bytes = capacity_bytes
+        self.reserved_bytes = 0
+        self._condition = threading.Condition()
+
+    def max_concurrent_jobs(self, budget_bytes):
+        return max(1, self.capacity_bytes // budget_bytes)
+
+    @contextmanager
+    def reserve(self, budget_bytes):
+        with self._condition:
+            start = time.monotonic()
+            self._condition.wait_for(
+                lambda: self.reserved_bytes == 0 or self.reserved_bytes + budget_bytes <= self.capacity_bytes
+            )
+            waited = time.monotonic() - start
+            if waited > 1:
+                logger.info(f"waited {waited:.1f}s for {budget_bytes / 1024 ** 2:.0f} MB of render memory")
+            self.reserved_bytes += budget_bytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.reserved_bytes -= budget_bytes
+                self._condition.notify_all()
+
+
+render_scheduler = MemoryScheduler(int(available_memory() * HOST_MEMORY_FRACTION))
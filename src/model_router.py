@@ -0,0 +1,127 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+from src.hedging import LatencyTracker
+
+# Candidate (model, max_tokens) of each LLM stage, from highest quality to fastest
+STAGE_MODELS = {
+    "topic": [("mistral-tiny", 50)],
+    "facts": [("mistral-large-latest", 2000), ("mistral-medium", 1000), ("mistral-small-latest", 600)],
+    "image_prompts": [("mistral-medium", None), ("mistral-small-latest", 500)],
+}
+
+# Index of the first candidate tried for each quality tier
+QUALITY_TIERS = {"high": 0, "balanced": 1, "fast": 2}
+
+# Share of a request's latency budget given to each LLM stage, the rest goes to
+# the search, the voiceover, the images and the render. With the 30 s interactive
+# budget, healthy first-choice models fit: 12 s for facts, 6 s for image prompts.
+STAGE_BUDGET_SHARE = {"topic": 0.05, "facts": 0.4, "image_prompts": 0.2}
+
+# p95 latency assumed for a healthy model until MIN_SAMPLES calls have been observed
+DEFAULT_P95_SEC = {
+    "mistral-large-latest": 10.0,
+    "mistral-medium": 5.0,
+    "mistral-small-latest": 3.0,
+    "mistral-tiny": 1.5,
+}
+MIN_SAMPLES = 5
+# Latencies older than this are forgotten, so a model that recovered is trusted again
+LATENCY_MAX_AGE_SEC = 10 * 60
+# Latency recorded for a failed or timed out call: the Mistral client's timeout, as if
+# the call never returned. A model failing fast (rate limit, unknown name) then
+# degrades instead of looking fast.
+FAILED_CALL_LATENCY_SEC = 120
+
+# Share of degraded calls sent to the next better model, so its latency keeps being
+# measured and the stage can recover once it is fast again
+PROBE_RATE = 0.05
+
+# Number of calls in flight on a stage above which it degrades to the next model
+QUEUE_DEGRADE_THRESHOLD = 4
+
+
+class ModelRouter:
+    """
+    Picks the model and token limit of each LLM stage from the request's latency budget
+    and quality tier, using the latencies it observes for every model.
+    """
+
+    def __init__(self):
+        self._trackers = {}
+        self._in_flight = {stage: 0 for stage in STAGE_MODELS}
+        self._lock = threading.Lock()
+
+    def _tracker(self, model):
+        with self._lock:
+            if model not in self._trackers:
+                self._trackers[model] = LatencyTracker(max_age_sec=LATENCY_MAX_AGE_SEC)
+            return self._trackers[model]
+
+    def p95(self, model):
+        tracker = self._tracker(model)
+        if len(tracker) < MIN_SAMPLES:
+            return DEFAULT_P95_SEC.get(model, 0.0)
+        return tracker.percentile(95)
+
+    def choose(self, stage, latency_budget=None, quality="high"):
+        """
+        Returns the (model, max_tokens) to use for a stage.
+
+        Args:
+            stage (str): Key of STAGE_MODELS
+            latency_budget (float): End-to-end latency budget of the request in seconds, None for no limit
+            quality (str): Key of QUALITY_TIERS
+        """
+        candidates = STAGE_MODELS[stage]
+        preferred_index = min(QUALITY_TIERS[quality], len(candidates) - 1)
+        index = preferred_index
+
+        with self._lock:
+            queue_length = self._in_flight[stage]
+        if queue_length >= QUEUE_DEGRADE_THRESHOLD:
+            index = min(index + 1, len(candidates) - 1)
+
+        if latency_budget is not None:
+            stage_budget = latency_budget * STAGE_BUDGET_SHARE[stage]
+            while index < len(candidates) - 1 and self.p95(candidates[index][0]) > stage_budget:
+                index += 1
+
+        probe = index > preferred_index and random.random() < PROBE_RATE
+        if probe:
+            index -= 1
+
+        model, max_tokens = candidates[index]
+        if probe:
+            logger.info(f"{stage}: probing {model} (budget {latency_budget}, quality {quality})")
+        elif index > 0:
+            logger.info(f"{stage}: routed to {model} (budget {latency_budget}, quality {quality}, queue {queue_length})")
+        return model, max_tokens
+
+    @contextmanager
+    def track(self, stage, model):
+        """
+        Counts the call as in flight on the stage and records the model's latency.
+        Failed and timed out calls are recorded as FAILED_CALL_LATENCY_SEC.
+        """
+        with self._lock:
+            self._in_flight[stage] += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            logger.warning(f"{stage}: {model} failed after {time.monotonic() - start:.2f}s: {e}")
+            self._tracker(model).observe(FAILED_CALL_LATENCY_SEC)
+            raise
+        else:
+            self._tracker(model).observe(time.monotonic() - start)
+        finally:
+            with self._lock:
+                self._in_flight[stage] -= 1
+
+
+model_router = ModelRouter()
@@ -0,0 +1,199 @@
+import json
+import os
+import random
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from loguru import logger
+
+from src import OUTPUT_DIR
+
+# Fraction of the runs profiled when the run does not ask for it explicitly
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL_SEC = 0.01
+PROFILE_TOP_N = 20
+
+FOLDED_FILE_NAME = "profile.folded"
+SPEEDSCOPE_FILE_NAME = "profile.speedscope.json"
+SUMMARY_FILE_NAME = "profile_summary.txt"
+
+_lock = threading.Lock()
+_active_profiles = {}
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    """
+    Sampling profiler of one run.
+
+    A background thread samples the Python stacks of the threads that are inside a
+    section (a graph node or a render step) every PROFILE_INTERVAL_SEC. Threads outside
+    any section are not sampled, so idle time costs nothing. Time spent waiting on the
+    network shows up as the waiting frames of the section's thread.
+    """
+
+    def __init__(self, run_id, output_dir, interval_sec=PROFILE_INTERVAL_SEC):
+        self.run_id = run_id
+        self.output_dir = output_dir
+        self.interval_sec = interval_sec
+        self.stacks = Counter()
+        self._sections = {}
+        self._sections_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler_{run_id}", daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    @contextmanager
+    def section(self, name):
+        thread_id = threading.get_ident()
+        with self._sections_lock:
+            self._sections.setdefault(thread_id, []).append(name)
+        try:
+            yield
+        finally:
+            with self._sections_lock:
+                self._sections[thread_id].pop()
+                if not self._sections[thread_id]:
+                    del self._sections[thread_id]
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_sec):
+            with self._sections_lock:
+                sections = {thread_id: tuple(names) for thread_id, names in self._sections.items()}
+            frames = sys._current_frames()
+            for thread_id, names in sections.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[names + tuple(reversed(stack))] += 1
+
+    def stop(self):
+        """Stops sampling and writes the folded stacks, speedscope file and hotspot summary"""
+        self._stop_event.set()
+        self._sampler.join()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._write_folded()
+        self._write_speedscope()
+        self._write_summary()
+        logger.info(f"profile of {self.run_id} written to {self.output_dir}")
+
+    def _write_folded(self):
+        # One "frame;frame;frame count" line per stack, the input of flamegraph.pl
+        with open(os.path.join(self.output_dir, FOLDED_FILE_NAME), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    def _write_speedscope(self):
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, count in self.stacks.items():
+            samples.append([frame_index.setdefault(name, len(frame_index)) for name in stack])
+            weights.append(count * self.interval_sec)
+
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.run_id,
+            "exporter": "random_facts",
+            "shared": {"frames": [{"name": name} for name in frame_index]},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.run_id,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+        with open(os.path.join(self.output_dir, SPEEDSCOPE_FILE_NAME), "w") as f:
+            json.dump(profile, f)
+
+    def _write_summary(self):
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack[-1]] += count
+            for name in set(stack):
+                total_samples[name] += count
+
+        n_samples = sum(self.stacks.values()) or 1
+        lines = [f"{n_samples} samples every {self.interval_sec * 1000:.0f} ms", "", f"Top {PROFILE_TOP_N} by self time:"]
+        for name, count in self_samples.most_common(PROFILE_TOP_N):
+            lines.append(f"{100 * count / n_samples:6.1f}%  {count * self.interval_sec:8.2f}s  {name}")
+        lines += ["", f"Top {PROFILE_TOP_N} by total time:"]
+        for name, count in total_samples.most_common(PROFILE_TOP_N):
+            lines.append(f"{100 * count / n_samples:6.1f}%  {count * self.interval_sec:8.2f}s  {name}")
+
+        with open(os.path.join(self.output_dir, SUMMARY_FILE_NAME), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def start_run_profile(run_id, enabled=None, output_dir=None):
+    """
+    Starts profiling a run.
+
+    Args:
+        run_id (str): The thread_id of the run
+        enabled (bool): Force profiling on or off, None samples PROFILE_SAMPLE_RATE of the runs
+        output_dir (str): Where the profile files go, defaults to the run's output directory
+
+    Returns:
+        RunProfiler: The profiler, or None when the run is not profiled
+    """
+    if enabled is None:
+        enabled = random.random() < PROFILE_SAMPLE_RATE
+    if not enabled:
+        return None
+
+    profiler = RunProfiler(run_id, output_dir or os.path.join(OUTPUT_DIR, run_id))
+    with _lock:
+        _active_profiles[run_id] = profiler
+    profiler.start()
+    return profiler
+
+
+def finish_run_profile(run_id):
+    """Stops the profiler of a run, if any, and writes its files"""
+    with _lock:
+        profiler = _active_profiles.pop(run_id, None)
+    if profiler is not None:
+        profiler.stop()
+
+
+@contextmanager
+def profile_section(run_id, name):
+    """Marks the current thread as working on a section of the run (no-op if not profiled)"""
+    with _lock:
+        profiler = _active_profiles.get(run_id)
+    if profiler is None:
+        yield
+        return
+    with profiler.section(name):
+        yield
+
+
+def profiled(run_id, name, fn):
+    """Wraps fn so that its calls are profiled as a section of the run"""
+    def wrapper(*args, **kwargs):
+        with profile_section(run_id, name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def profiled_node(name, node):
+    """Wraps a graph node so that it is profiled as a section of the run of its state"""
+    def wrapper(state):
+        with profile_section(state.get("thread_id"), name):
+            return node(state)
+    return wrapper
@@ -0,0 +1,272 @@
+import os
+import tempfile
+from contextlib import nullcontext
+
+import cv2
+import ffmpeg
+from loguru import logger
+from PIL import Image
+
+from src import PROJECT_ROOT
+from src.memory import (
+    MemoryProfile, fit_source_height, render_scheduler,
+    RENDER_MEMORY_BUDGET_BYTES, DRAFT_MEMORY_BUDGET_BYTES,
+)
+from src.video_from_images import plan_image_timeline, build_image_timeline, VIDEO_FPS
+
+FONT_NAME = "Quattrocento Sans"
+FONT_DIR = PROJECT_ROOT
+
+# Output geometries rendered from the single image/effect timeline. "fit" decides
+# how the 9:16 source images are adapted: "crop" fills the frame, "pad" letterboxes.
+# Subtitle sizes and margins are in pixels of the output geometry.
+OUTPUT_FORMATS = {
+    "9:16": {"size": (1080, 1920), "fit": "crop", "font_size": 96, "subtitle_margin": 260, "suffix": ""},
+    "1:1": {"size": (1080, 1080), "fit": "crop", "font_size": 80, "subtitle_margin": 120, "suffix": "_1x1"},
+    "16:9": {"size": (1920, 1080), "fit": "pad", "font_size": 72, "subtitle_margin": 80, "suffix": "_16x9"},
+}
+
+DEFAULT_FORMATS = list(OUTPUT_FORMATS)
+
+FINAL_VIDEO_NAME = "video_with_audio_subtitle"
+
+# Draft preview: same timeline, low resolution, low fps and the fastest x264 preset
+DRAFT_FORMAT = "9:16"
+DRAFT_HEIGHT = 480
+DRAFT_FPS = 10
+DRAFT_VIDEO_NAME = "video_draft.mp4"
+DRAFT_ENCODER_ARGS = {"preset": "ultrafast", "crf": 35, "audio_bitrate": "64k"}
+
+
+def output_path_for_format(output_folder, format_name):
+    """Returns the path of the final video for the given output format"""
+    suffix = OUTPUT_FORMATS[format_name]["suffix"]
+    return os.path.join(output_folder, f"{FINAL_VIDEO_NAME}{suffix}.mp4")
+
+
+def _ass_timestamp(seconds):
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def write_ass_subtitles(synthesis_durations, format_name, ass_file_path):
+    """
+    Writes the word timings returned by LMNT as an ASS subtitle file placed for one output format.
+
+    Args:
+        synthesis_durations (list): Word timings with 'text', 'start' and 'duration' keys
+        format_name (str): Key of OUTPUT_FORMATS
+        ass_file_path (str): Path where the .ass file will be saved
+    """
+    spec = OUTPUT_FORMATS[format_name]
+    width, height = spec["size"]
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        # BorderStyle 3 draws an opaque black box behind each word, like the moviepy TextClip bg_color
+        f"Style: Default,{FONT_NAME},{spec['font_size']},&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,"
+        f"0,0,0,0,100,100,0,0,3,8,0,2,20,20,{spec['subtitle_margin']},1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for sub_data in synthesis_durations:
+        text = sub_data["text"].strip().replace("{", "(").replace("}", ")")
+        if not text:
+            continue
+        start = sub_data["start"]
+        end = start + sub_data["duration"]
+        lines.append(f"Dialogue: 0,{_ass_timestamp(start)},{_ass_timestamp(end)},Default,,0,0,0,,{text}")
+
+    with open(ass_file_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def _fit_to_size(stream, width, height, fit):
+    if fit == "crop":
+        stream = stream.filter("scale", width, height, force_original_aspect_ratio="increase")
+        stream = stream.filter("crop", width, height)
+    else:
+        stream = stream.filter("scale", width, height, force_original_aspect_ratio="decrease")
+        stream = stream.filter("pad", width, height, "(ow-iw)/2", "(oh-ih)/2")
+    return stream.filter("setsar", 1)
+
+
+def _source_height_for_targets(targets, source_aspect):
+    """Returns the smallest image height that covers every target once cropped/padded"""
+    needed_heights = []
+    for format_name, _, (width, height), _ in targets:
+        if OUTPUT_FORMATS[format_name]["fit"] == "crop":
+            needed_heights.append(max(width / source_aspect, height))
+        else:
+            needed_heights.append(min(width / source_aspect, height))
+    return int(round(max(needed_heights)))
+
+
+def _close_timeline(video):
+    for clip in getattr(video, "clips", []):
+        for child in getattr(clip, "clips", []):
+            child.close()
+        clip.close()
+    video.close()
+
+
+def _render_timeline(timeline_plan, audio_file_path, synthesis_durations, targets, fps, memory_budget,
+                     scheduled=True, trace_python=False):
+    """
+    Pipes the frames of a timeline into one ffmpeg process with one encoder branch per target.
+
+    Each target is a (format_name, output_path, (width, height), encoder_args) tuple. The
+    subtitles of a target are laid out for its format and scaled by libass to its size.
+
+    The images are decoded at the smallest height the targets need, lowered further if
+    needed to fit memory_budget. Scheduled renders wait until the host has room for them.
+    """
+    # Only the image header is read here
+    with Image.open(timeline_plan[0][0]) as image:
+        native_width, native_height = image.size
+    source_aspect = native_width / native_height
+
+    source_height = min(native_height, _source_height_for_targets(targets, source_aspect))
+    source_height = fit_source_height(
+        memory_budget, len(timeline_plan), source_height, source_aspect, [target[2] for target in targets]
+    )
+
+    formats = [target[0] for target in targets]
+    reservation = render_scheduler.reserve(memory_budget) if scheduled else nullcontext()
+    with reservation, MemoryProfile(f"render {formats}", memory_budget, trace_python=trace_python):
+        _encode_timeline(timeline_plan, audio_file_path, synthesis_durations, targets, fps, source_height)
+
+
+def _encode_timeline(timeline_plan, audio_file_path, synthesis_durations, targets, fps, source_height):
+    video = build_image_timeline(timeline_plan, target_height=source_height)
+    width, height = video.size
+
+    video_input = ffmpeg.input("pipe:", format="rawvideo", pix_fmt="rgb24", s=f"{width}x{height}", framerate=fps)
+    audio_input = ffmpeg.input(audio_file_path)
+    branches = video_input.video.filter_multi_output("split", len(targets))
+
+    # The subtitles filter reads its file from a path inside the filtergraph, where quotes
+    # in the run folder (named after the user input) cannot be escaped reliably
+    with tempfile.TemporaryDirectory(prefix="subtitles_") as subtitles_dir:
+        outputs = []
+        for index, (format_name, output_path, size, encoder_args) in enumerate(targets):
+            ass_file_path = os.path.join(subtitles_dir, f"{index}.ass")
+            write_ass_subtitles(synthesis_durations, format_name, ass_file_path)
+
+            stream = _fit_to_size(branches.stream(index), *size, OUTPUT_FORMATS[format_name]["fit"])
+            stream = stream.filter("subtitles", ass_file_path, fontsdir=FONT_DIR)
+
+            outputs.append(ffmpeg.output(
+                stream, audio_input.audio, output_path,
+                vcodec="libx264", acodec="aac", pix_fmt="yuv420p", shortest=None, **encoder_args,
+            ))
+
+        process = (
+            ffmpeg.merge_outputs(*outputs)
+            .global_args("-hide_banner", "-loglevel", "error")
+            .overwrite_output()
+            .run_async(pipe_stdin=True)
+        )
+
+        # When ffmpeg exits early the pipe breaks, its exit code is reported below instead
+        try:
+            try:
+                for frame in video.iter_frames(fps=fps, dtype="uint8"):
+                    if frame.shape[:2] != (height, width):
+                        frame = cv2.resize(frame, (width, height))
+                    process.stdin.write(frame[:, :, :3].tobytes())
+            except BrokenPipeError:
+                pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            return_code = process.wait()
+            _close_timeline(video)
+
+    if return_code != 0:
+        formats = [target[0] for target in targets]
+        raise Exception(f"ffmpeg exited with code {return_code} while rendering {formats}")
+
+
+def render_all_formats(output_folder, audio_file_path, synthesis_durations, video_duration_sec,
+                       formats=DEFAULT_FORMATS, timeline_plan=None, memory_budget=RENDER_MEMORY_BUDGET_BYTES,
+                       trace_python=False):
+    """
+    Renders the final subtitled video in several output geometries in a single pass.
+
+    The image/effect timeline is decoded and composed once with moviepy; its frames are
+    piped into one ffmpeg process that splits them into one crop/pad, subtitle and
+    encoder branch per format. Adding a format only costs its encode.
+
+    Args:
+        output_folder (str): Run folder containing the .png images
+        audio_file_path (str): Path to the voiceover .wav file
+        synthesis_durations (list): Word timings used for the subtitles
+        video_duration_sec (float): Length of the video in seconds
+        formats (list): Keys of OUTPUT_FORMATS to render
+        timeline_plan (list): Plan from plan_image_timeline, drawn here if None
+        memory_budget (int): Memory budget of the render in bytes (see src.memory)
+        trace_python (bool): Also measure the Python allocations with tracemalloc (slower)
+
+    Returns:
+        dict: Output file path for each rendered format
+    """
+    logger.info(f"render_all_formats {formats}...")
+
+    if timeline_plan is None:
+        timeline_plan = plan_image_timeline(output_folder, video_duration_sec)
+
+    output_paths = {format_name: output_path_for_format(output_folder, format_name) for format_name in formats}
+    targets = [
+        (format_name, output_paths[format_name], OUTPUT_FORMATS[format_name]["size"], {})
+        for format_name in formats
+    ]
+    _render_timeline(timeline_plan, audio_file_path, synthesis_durations, targets, VIDEO_FPS, memory_budget,
+                     trace_python=trace_python)
+
+    return output_paths
+
+
+def render_draft(output_folder, audio_file_path, synthesis_durations, video_duration_sec, timeline_plan=None,
+                 memory_budget=DRAFT_MEMORY_BUDGET_BYTES, trace_python=False):
+    """
+    Renders a low-resolution, low-fps preview of the same timeline as render_all_formats.
+
+    The images are decoded at the draft size so moviepy composes small frames, which makes
+    the draft playable within a few seconds. It does not queue behind full renders in the
+    memory scheduler; its small budget is not reserved. Pass the same timeline_plan to both
+    renders so the draft matches the final video.
+
+    Returns:
+        str: Path of the draft video
+    """
+    logger.info("render_draft...")
+
+    if timeline_plan is None:
+        timeline_plan = plan_image_timeline(output_folder, video_duration_sec)
+
+    format_width, format_height = OUTPUT_FORMATS[DRAFT_FORMAT]["size"]
+    # libx264 needs even dimensions
+    draft_width = int(format_width * DRAFT_HEIGHT / format_height) // 2 * 2
+    draft_path = os.path.join(output_folder, DRAFT_VIDEO_NAME)
+
+    targets = [(DRAFT_FORMAT, draft_path, (draft_width, DRAFT_HEIGHT), DRAFT_ENCODER_ARGS)]
+    _render_timeline(timeline_plan, audio_file_path, synthesis_durations, targets, DRAFT_FPS, memory_budget,
+                     scheduled=False, trace_python=trace_python)
+
+    return draft_path
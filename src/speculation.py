@@ -0,0 +1,66 @@
+import re
+import threading
+from difflib import SequenceMatcher
+
+from loguru import logger
+
+# Speculative search: search the raw user input while the topic is being extracted.
+# Off by default: a search already running cannot be cancelled, so every miss costs
+# two Tavily calls (the speculative one and the search of the extracted topic)
+SPECULATIVE_SEARCH = False
+# Minimum similarity between the normalized input and topic for the search to be reused
+SIMILARITY_THRESHOLD = 0.85
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "failed": 0, "latency_saved_sec": 0.0}
+
+
+def normalize_query(text):
+    """Lowercases, drops punctuation and collapses whitespace"""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+def query_similarity(query, topic):
+    """Returns the similarity ratio (0 to 1) between two normalized queries"""
+    if query == topic:
+        return 1.0
+    return SequenceMatcher(None, query, topic).ratio()
+
+
+def record_speculation(hit, similarity, latency_saved_sec=0.0, failed=False):
+    """
+    Records the outcome of a speculative search. A search that raised is a miss
+    flagged as failed.
+
+    Returns:
+        dict: Per-run report saved along with the run's results
+    """
+    with _lock:
+        _stats["hits" if hit else "misses"] += 1
+        _stats["failed"] += int(failed)
+        _stats["latency_saved_sec"] += latency_saved_sec
+
+    outcome = "failed" if failed else ("hit" if hit else "miss")
+    logger.info(
+        f"speculative search {outcome} (similarity {similarity:.2f}), "
+        f"{latency_saved_sec:.2f}s saved"
+    )
+    return {"hit": hit, "failed": failed, "similarity": similarity, "latency_saved_sec": latency_saved_sec}
+
+
+def get_speculation_stats():
+    """
+    Returns the speculative search counters.
+
+    Returns:
+        dict: hits, misses (failed searches included), hit rate and total / average
+              latency saved per hit
+    """
+    with _lock:
+        attempts = _stats["hits"] + _stats["misses"]
+        return {
+            **_stats,
+            "hit_rate": _stats["hits"] / attempts if attempts else 0.0,
+            "avg_latency_saved_sec": _stats["latency_saved_sec"] / _stats["hits"] if _stats["hits"] else 0.0,
+        }
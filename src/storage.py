@@ -0,0 +1,270 @@
+import fcntl
+import fnmatch
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from loguru import logger
+
+from src import OUTPUT_DIR
+
+# Runs older than this keep only their final artifacts
+RETENTION_HOURS = 24
+# Total size allowed under OUTPUT_DIR, least recently used runs are evicted beyond it
+OUTPUT_QUOTA_BYTES = 20 * 1024 ** 3
+MAINTENANCE_INTERVAL_SEC = 15 * 60
+
+# Files kept by the retention policy, everything else in a run is an intermediate
+KEEP_PATTERNS = ["video_with_audio_subtitle*.mp4", "result.json", "profile*"]
+
+CATALOGUE_PATH = os.path.join(OUTPUT_DIR, "catalogue.json")
+CATALOGUE_LOCK_PATH = CATALOGUE_PATH + ".lock"
+
+_catalogue_lock = threading.RLock()
+_lock_depth = 0
+_lock_file = None
+
+
+@contextmanager
+def _catalogue_locked():
+    """
+    Serializes catalogue updates across threads and processes (the Streamlit app and
+    `python -m src.storage`). Reentrant within the thread holding it.
+    """
+    global _lock_depth, _lock_file
+    with _catalogue_lock:
+        if _lock_depth == 0:
+            _lock_file = open(CATALOGUE_LOCK_PATH, "w")
+            fcntl.flock(_lock_file, fcntl.LOCK_EX)
+        _lock_depth += 1
+        try:
+            yield
+        finally:
+            _lock_depth -= 1
+            if _lock_depth == 0:
+                fcntl.flock(_lock_file, fcntl.LOCK_UN)
+                _lock_file.close()
+                _lock_file = None
+
+
+def load_catalogue():
+    """
+    Loads the on-disk catalogue of runs.
+
+    Returns:
+        dict: run_id -> {"created", "last_access", "size", "files", "compacted", "topic"}
+    """
+    with _catalogue_locked():
+        if not os.path.exists(CATALOGUE_PATH):
+            return {}
+        with open(CATALOGUE_PATH) as f:
+            return json.load(f)
+
+
+def _save_catalogue(catalogue):
+    # Write to a temporary file and rename so readers never see a partial catalogue
+    fd, tmp_path = tempfile.mkstemp(dir=OUTPUT_DIR, prefix="catalogue.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(catalogue, f, separators=(",", ":"))
+        os.replace(tmp_path, CATALOGUE_PATH)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _scan_run(run_dir):
+    files = {}
+    with os.scandir(run_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                files[entry.name] = entry.stat().st_size
+    return files
+
+
+def _read_topic(run_dir):
+    try:
+        with open(os.path.join(run_dir, "result.json")) as f:
+            return json.load(f).get("topic")
+    except (OSError, ValueError):
+        return None
+
+
+def register_run(run_id, created=None):
+    """
+    Adds or refreshes a run in the catalogue, scanning only that run's directory.
+
+    Args:
+        run_id (str): Name of the run directory under OUTPUT_DIR (the thread_id)
+        created (float): Creation and last access timestamp of a run found on disk,
+                         defaults to now
+    """
+    run_dir = os.path.join(OUTPUT_DIR, run_id)
+    files = _scan_run(run_dir)
+    now = time.time()
+
+    with _catalogue_locked():
+        catalogue = load_catalogue()
+        entry = catalogue.get(run_id, {"created": created or now, "compacted": False})
+        entry.update({
+            "last_access": created or now,
+            "files": files,
+            "size": sum(files.values()),
+            "topic": _read_topic(run_dir),
+        })
+        catalogue[run_id] = entry
+        _save_catalogue(catalogue)
+
+
+def touch_run(run_id):
+    """Marks a run as recently used so the quota evicts it last"""
+    with _catalogue_locked():
+        catalogue = load_catalogue()
+        if run_id in catalogue:
+            catalogue[run_id]["last_access"] = time.time()
+            _save_catalogue(catalogue)
+
+
+def _register_uncatalogued(older_than=None):
+    """
+    Registers the run directories missing from the catalogue, e.g. runs that failed
+    before save_state. Only the top level of OUTPUT_DIR is listed.
+
+    Args:
+        older_than (float): Only register directories last modified before this timestamp
+    """
+    with _catalogue_locked():
+        catalogue = load_catalogue()
+        with os.scandir(OUTPUT_DIR) as entries:
+            for entry in entries:
+                if not entry.is_dir() or entry.name in catalogue:
+                    continue
+                modified = entry.stat().st_mtime
+                if older_than is None or modified < older_than:
+                    register_run(entry.name, created=modified)
+
+
+def rebuild_catalogue():
+    """Rebuilds the catalogue from a full walk of OUTPUT_DIR, e.g. for runs made before it existed"""
+    with _catalogue_locked():
+        _register_uncatalogued()
+        catalogue = load_catalogue()
+        for run_id in list(catalogue):
+            if not os.path.isdir(os.path.join(OUTPUT_DIR, run_id)):
+                del catalogue[run_id]
+        _save_catalogue(catalogue)
+        return catalogue
+
+
+def _is_kept(file_name):
+    return any(fnmatch.fnmatch(file_name, pattern) for pattern in KEEP_PATTERNS)
+
+
+def apply_retention(retention_hours=RETENTION_HOURS):
+    """
+    Deletes the intermediate files of runs older than retention_hours. Runs left with
+    no files at all (e.g. runs that failed before save_state) are removed entirely.
+
+    Returns:
+        int: Number of bytes freed
+    """
+    freed = 0
+    cutoff = time.time() - retention_hours * 3600
+
+    with _catalogue_locked():
+        catalogue = load_catalogue()
+        for run_id, entry in list(catalogue.items()):
+            if entry["compacted"] or entry["created"] > cutoff:
+                continue
+
+            run_dir = os.path.join(OUTPUT_DIR, run_id)
+            for file_name in [name for name in entry["files"] if not _is_kept(name)]:
+                try:
+                    os.remove(os.path.join(run_dir, file_name))
+                except FileNotFoundError:
+                    pass
+                freed += entry["files"].pop(file_name)
+
+            if not entry["files"]:
+                shutil.rmtree(run_dir, ignore_errors=True)
+                del catalogue[run_id]
+                continue
+
+            entry["size"] = sum(entry["files"].values())
+            entry["compacted"] = True
+        _save_catalogue(catalogue)
+
+    return freed
+
+
+def enforce_quota(quota_bytes=OUTPUT_QUOTA_BYTES):
+    """
+    Evicts whole runs, least recently used first, until OUTPUT_DIR fits in quota_bytes.
+
+    Returns:
+        list: Evicted run ids
+    """
+    evicted = []
+
+    with _catalogue_locked():
+        catalogue = load_catalogue()
+        total_size = sum(entry["size"] for entry in catalogue.values())
+
+        for run_id in sorted(catalogue, key=lambda run: catalogue[run]["last_access"]):
+            if total_size <= quota_bytes:
+                break
+            shutil.rmtree(os.path.join(OUTPUT_DIR, run_id), ignore_errors=True)
+            total_size -= catalogue.pop(run_id)["size"]
+            evicted.append(run_id)
+
+        _save_catalogue(catalogue)
+
+    return evicted
+
+
+def run_maintenance(retention_hours=RETENTION_HOURS, quota_bytes=OUTPUT_QUOTA_BYTES):
+    """
+    Applies the retention policy then the size quota, after cataloguing the run
+    directories older than the retention window that were never registered.
+
+    Returns:
+        dict: Bytes freed by retention and run ids evicted by the quota
+    """
+    _register_uncatalogued(older_than=time.time() - retention_hours * 3600)
+    freed = apply_retention(retention_hours)
+    evicted = enforce_quota(quota_bytes)
+    logger.info(f"storage maintenance: {freed} bytes of intermediates freed, {len(evicted)} runs evicted")
+    return {"freed_bytes": freed, "evicted_runs": evicted}
+
+
+def start_periodic_maintenance(interval_sec=MAINTENANCE_INTERVAL_SEC):
+    """
+    Runs run_maintenance every interval_sec in a daemon thread.
+
+    Returns:
+        threading.Event: Set it to stop the maintenance thread
+    """
+    stop_event = threading.Event()
+
+    def loop():
+        while not stop_event.wait(interval_sec):
+            try:
+                run_maintenance()
+            except Exception as e:
+                logger.error(f"storage maintenance failed: {e}")
+
+    threading.Thread(target=loop, name="storage_maintenance", daemon=True).start()
+    return stop_event
+
+
+if __name__ == "__main__":
+
+    if "--rebuild" in sys.argv:
+        print(f"{len(rebuild_catalogue())} runs in the catalogue")
+
+    print(run_maintenance())
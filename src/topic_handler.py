@@ -30,15 +30,15 @@ FALLBACK_TOPICS = [
 
 
 
-def create_topic_chain():
+def create_topic_chain(model="mistral-tiny", max_tokens=50):
     """
     Creates a LangChain pipeline for topic handling.
     """
     # Initialize the model
     llm = ChatMistralAI(
-        model="mistral-tiny",
+        model=model,
         temperature=0.7,
-        max_tokens=50,
+        max_tokens=max_tokens,
     )
     
     parser = PydanticOutputParser(pydantic_object=TopicOutput)
@@ -71,26 +71,65 @@ def ensure_video_length(images_path, duration_per_image_list, video_duration_sec
 #     cv2.destroyAllWindows()
 #     video.release()
 
-def video_from_images_moviepy(image_folder, video_file_path, video_duration_sec):
-
-    print('video_from_images_moviepy...')
-
+def plan_image_timeline(image_folder, video_duration_sec):
+    """
+    Draws the random image durations and effects of a run once, so that every
+    render of the run (draft or full quality) shows the same timeline.
+
+    Args:
+        image_folder (str): Folder containing the generated .png images
+        video_duration_sec (float): Target length of the video in seconds
+
+    Returns:
+        list: (image_path, duration, effect) tuples in playback order
+    """
     images_path = [img for img in os.listdir(image_folder) if img.endswith(".png")]
     images_path = images_path[:MAX_IMAGES_IN_VIDEO]
 
-    clips = []
     duration_per_image_list = [int(random.uniform(MIN_SEC_PER_IMAGE, MAX_SEC_PER_IMAGE)) for _ in images_path]
     images_path, duration_per_image_list = ensure_video_length(images_path, duration_per_image_list, video_duration_sec)
 
-    for image, duration_per_image in zip(images_path, duration_per_image_list):
-        image_path = os.path.join(image_folder, image)
-        random_effect = random_moviepy_effect()
-        image_clip = ImageClip(image_path, duration=duration_per_image).with_effects(random_effect)
+    return [
+        (os.path.join(image_folder, image), duration_per_image, random_moviepy_effect())
+        for image, duration_per_image in zip(images_path, duration_per_image_list)
+    ]
+
+def load_image(image_path, target_height=None):
+    """Loads an image as an RGB array, downscaled to target_height when it is taller"""
+    image = cv2.cvtColor(cv2.imread(image_path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    height, width = image.shape[:2]
+    if target_height is not None and height > target_height:
+        target_width = int(round(width * target_height / height))
+        image = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_AREA)
+    return image
+
+def build_image_timeline(timeline_plan, target_height=None):
+    """
+    Builds the image/effect clip described by a timeline plan.
+
+    Args:
+        timeline_plan (list): Output of plan_image_timeline
+        target_height (int): Downscale the images to this height at load (full resolution if None)
+
+    Returns:
+        VideoClip: Concatenated clip with the planned effects applied
+    """
+    clips = []
+    for image_path, duration_per_image, effect in timeline_plan:
+        image = image_path if target_height is None else load_image(image_path, target_height)
+        image_clip = ImageClip(image, duration=duration_per_image).with_effects(effect)
         clip = CompositeVideoClip([image_clip])
         clips.append(clip)
 
-    video = concatenate_videoclips(clips)
-    video.write_videofile(video_file_path, fps=30)
+    return concatenate_videoclips(clips)
+
+def video_from_images_moviepy(image_folder, video_file_path, video_duration_sec):
+
+    print('video_from_images_moviepy...')
+
+    timeline_plan = plan_image_timeline(image_folder, video_duration_sec)
+    video = build_image_timeline(timeline_plan)
+    video.write_videofile(video_file_path, fps=VIDEO_FPS)
 
 if __name__ == "__main__":
 
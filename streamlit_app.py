@@ -1,14 +1,23 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from src.fact_workflow import create_fact_workflow
-from src.video_from_images import video_from_images_moviepy
-from src.audio_subtitles import join_video_with_audio, add_subtitle_to_video
+from src.render_formats import render_all_formats, render_draft
+from src.video_from_images import plan_image_timeline
+from src.storage import register_run, start_periodic_maintenance
+from src.memory import render_scheduler, RENDER_MEMORY_BUDGET_BYTES
+from src.profiling import start_run_profile, finish_run_profile, profiled
+from concurrent.futures import ThreadPoolExecutor
 import json
+import threading
 from datetime import datetime
 from src import DATA_DIR
 
 import logging
 from loguru import logger
 
+# Interactive requests route their LLM stages to faster models to stay within this budget
+INTERACTIVE_LATENCY_BUDGET_SEC = 30
+
 class StreamlitLogHandler(logging.Handler):
     def __init__(self, widget_update_func):
         super().__init__()
@@ -18,6 +27,17 @@ class StreamlitLogHandler(logging.Handler):
         msg = self.format(record)
         self.widget_update_func(msg)
 
+def with_script_run_ctx(fn):
+    """Runs fn in a worker thread with the current session's context, so its logs reach the page"""
+    ctx = get_script_run_ctx()
+    def wrapper(*args, **kwargs):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            add_script_run_ctx(threading.current_thread(), None)
+    return wrapper
+
 
 
 st.title("Historical Facts Video Generator")
@@ -30,6 +50,28 @@ def get_workflow():
 
 workflow = get_workflow()
 
+# Full-quality renders run here while the draft preview is shown. The memory
+# scheduler admits as many renders as their budgets fit on the host.
+@st.cache_resource
+def get_render_executor():
+    return ThreadPoolExecutor(max_workers=render_scheduler.max_concurrent_jobs(RENDER_MEMORY_BUDGET_BYTES))
+
+render_executor = get_render_executor()
+
+# Drafts get their own workers so they never wait behind full renders
+@st.cache_resource
+def get_draft_executor():
+    return ThreadPoolExecutor(max_workers=2)
+
+draft_executor = get_draft_executor()
+
+# Retention and quota of data/output, see src/storage.py
+@st.cache_resource
+def get_storage_maintenance():
+    return start_periodic_maintenance()
+
+get_storage_maintenance()
+
 
 # Text input field
 user_input = st.text_input(
@@ -39,6 +81,12 @@ user_input = st.text_input(
 
 
 
+# Profile the run (otherwise sampled at PROFILE_SAMPLE_RATE)
+profile_run = st.checkbox("Profile this run", value=False)
+# Trace the Python allocations of the renders with tracemalloc. Separate from profiling:
+# it slows every allocation of the process, other users' renders included
+trace_allocations = st.checkbox("Trace Python allocations of the renders (slow)", value=False)
+
 # Button to generate the video
 if st.button("Generate Video") and user_input:
     st.write(f"Generating video for: {user_input}")
@@ -56,46 +104,103 @@ if st.button("Generate Video") and user_input:
         # Generate thread ID
         thread_id = datetime.now().strftime("%Y%m%d_%H%M%S") + "_" + user_input
 
-        # Create the video
-        result = workflow.invoke({
-            "user_input": user_input,
-            "thread_id": thread_id,
-        })
-
         # # Set up file paths
         output_folder = f"{DATA_DIR}/output/{thread_id}"
-        video_file_path = output_folder + "/video.mp4"
-        audio_file_path = output_folder + "/output.wav"
-        video_with_audio_path = output_folder + '/video_with_audio.mp4'
         subtitle_file_path = output_folder + '/result.json'
-        video_with_audio_subtitle_path = output_folder + '/video_with_audio_subtitle.mp4'
-
-        # Load video duration
-        with open(subtitle_file_path) as file:
-            video_duration_sec = json.load(file)["audio_duration"]
-
-        logger.info('video_from_images_moviepy...')
 
-        # Generate final video
-        video_from_images_moviepy(output_folder, video_file_path, video_duration_sec)
-
-        logger.info('join_video_with_audio...')
-        join_video_with_audio(video_file_path, audio_file_path, video_with_audio_path)
-        
-        logger.info('add_subtitle_to_video...')
-        add_subtitle_to_video(video_with_audio_path, subtitle_file_path, video_with_audio_subtitle_path)
-
-        # Display the final video
+        # Profiling files are written next to result.json
+        profiler = start_run_profile(thread_id, enabled=profile_run or None)
+
+        # Stop the profiler even when the workflow or a render fails
+        try:
+            # Placeholders filled in as soon as the node producing them finishes
+            topic_placeholder = st.empty()
+            fact_placeholder = st.empty()
+            audio_placeholder = st.empty()
+            images_placeholder = st.empty()
+            video_placeholder = st.empty()
+
+            full_render = None
+            draft_render = None
+
+            # Stream the workflow node by node. With a plain Graph, "values" yields
+            # {node: state} for each node that finished ("updates" nests it once more)
+            for update in workflow.stream({
+                "user_input": user_input,
+                "thread_id": thread_id,
+                "latency_budget": INTERACTIVE_LATENCY_BUDGET_SEC,
+                "quality": "high",
+            }, stream_mode="values"):
+                for node_name, state in update.items():
+
+                    if node_name == "process_topic":
+                        topic_placeholder.markdown(f"**Topic:** {state['topic']}")
+
+                    elif node_name == "generate_facts":
+                        with fact_placeholder.container():
+                            st.markdown(f"**Viral fact:** {state['viral_fact']}")
+                            st.markdown(state["description"])
+
+                    elif node_name == "generate_audio" and state["audio_filepath"]:
+                        audio_placeholder.audio(state["audio_filepath"])
+
+                    elif node_name == "generate_image":
+                        images_placeholder.image(state["image_filepaths"], width=200)
+
+                        # Images, audio and word timings are ready: start rendering right away,
+                        # drawing the timeline once so the draft and the final video match
+                        if state["audio_filepath"]:
+                            timeline_plan = plan_image_timeline(output_folder, state["audio_duration"])
+                            render_args = (
+                                output_folder,
+                                state["audio_filepath"],
+                                state["synthesis_durations"],
+                                state["audio_duration"],
+                            )
+                            draft_render = draft_executor.submit(
+                                with_script_run_ctx(profiled(thread_id, "render_draft", render_draft)), *render_args,
+                                timeline_plan=timeline_plan, trace_python=trace_allocations,
+                            )
+                            full_render = render_executor.submit(
+                                with_script_run_ctx(profiled(thread_id, "render_all_formats", render_all_formats)), *render_args,
+                                timeline_plan=timeline_plan, trace_python=trace_allocations,
+                            )
+
+            if full_render is None:
+                st.error("Audio generation failed, no video could be rendered.")
+                st.stop()
+
+            # Show a low-resolution draft as soon as it is ready. It is only a preview,
+            # so a failed draft still waits for the full-quality video
+            try:
+                draft_path = draft_render.result()
+            except Exception as e:
+                logger.error(f"draft render failed: {e}")
+            else:
+                with video_placeholder.container():
+                    st.caption("Draft preview, the full-quality video is still rendering...")
+                    st.video(draft_path)
+
+            video_paths = full_render.result()
+        finally:
+            finish_run_profile(thread_id)
+        try:
+            register_run(thread_id)
+        except Exception as e:
+            logger.error(f"could not register run in the storage catalogue: {e}")
+
+        # Swap in the final video
         st.success("Video generated successfully!")
 
+        with video_placeholder.container():
+            format_tabs = st.tabs(list(video_paths))
+            for format_tab, video_path in zip(format_tabs, video_paths.values()):
+                format_tab.video(video_path)
+
         # Display the subtitle JSON content
         with open(subtitle_file_path) as file:
             subtitle_data = json.load(file)
 
-        st.video(video_with_audio_subtitle_path)
-
-        st.markdown(subtitle_data['description'])
-
         st.subheader("Intermediate data and prompts")
         st.json(subtitle_data)
         
\ No newline at end of file